@@ -12,15 +12,49 @@ This package contains functions and tools to work with
 :author: Ismail SEZEN (sezenismail@gmail.com)
 """
 
-from math import log10 as _log10
-from math import floor as _floor
+from math import ceil as _ceil
+from math import log2 as _log2
+from functools import lru_cache as _lru_cache
+from hashlib import md5 as _md5
+from os import environ as _environ
+from os import getpid as _getpid
+from os import makedirs as _makedirs
+from os import remove as _remove
+from os import replace as _replace
+from os import stat as _stat
+from os.path import expanduser as _expanduser
+from os.path import isfile as _isfile
+from os.path import join as _join
 import logging as _logging
+from logging.handlers import MemoryHandler as _MemoryHandler
 import numpy as _np
 import xarray as _xr
 
 from nchandy import file
 from nchandy.file import _log
 
+try:
+    import netCDF4 as _nc4
+    from netCDF4 import Dataset as _nc4_Dataset  # pylint: disable=E0611
+except ImportError:
+    _nc4 = _nc4_Dataset = None
+
+try:
+    import xesmf as _xe  # pylint: disable=E0401
+except ImportError:
+    _xe = None
+
+try:
+    from concurrent_log_handler import \
+        ConcurrentRotatingFileHandler as _ConcurrentFileHandler
+except ImportError:
+    _ConcurrentFileHandler = None
+
+try:
+    import numba as _numba  # pylint: disable=E0401
+except ImportError:
+    _numba = None
+
 __all__ = ['file', ]
 __version__ = '0.0.1.dev'
 __author__ = 'Ismail SEZEN'
@@ -38,56 +72,135 @@ _log_formatter_ = _logging.Formatter(
     '%(asctime)s.%(msecs)03d - %(name)s - %(levelname)s - %(message)s',
     datefmt='%Y-%m-%dT%H:%M:%S')
 
+# compression algorithm: netCDF4 compression filter name
+# (blosc filters shuffle the bytes themselves; plain zstd would not)
+_algo_names_ = {'zstd': 'blosc_zstd', 'lz4': 'blosc_lz4', 'zlib': 'zlib'}
+_algo_available_ = {
+    'zstd': bool(getattr(_nc4, '__has_blosc_support__', False)),
+    'lz4': bool(getattr(_nc4, '__has_blosc_support__', False)),
+    'zlib': True}
+_blosc_min_bytes_ = 128  # blosc fails on smaller (uncompressible) buffers
+_chunk_min_bytes_ = 1 << 14  # a 2-D plane this large is chunked alone
+_chunk_bytes_ = 1 << 20  # target size of smaller on-disk chunks
+_slab_bytes_ = 1 << 24  # size of slabs processed at once by array kernels
+_exclude_vars_ = file._exclude_vars_  # pylint: disable=W0212
+_threads_ = None  # threads of numba kernels and ncks stats; None is all CPUs
+_regridders_ = {}  # xesmf.Regridder objects per source/target grid
+_nc_magic_ = (b'\x89HDF\r\n\x1a\n', b'CDF')  # NetCDF4 and classic formats
+# regridding weights cache; NCHANDY_WEIGHTS_DIR='' (or None here) disables it
+_weights_dir_ = _environ.get('NCHANDY_WEIGHTS_DIR', _join(
+    _environ.get('XDG_CACHE_HOME', _expanduser('~/.cache')), 'nchandy')) \
+    or None
+
+
+@_lru_cache(maxsize=4096)
+def _probe(path, mtime, size):  # pylint: disable=W0613
+    """
+    Read header information of a NetCDF file once.
+
+    mtime and size are only part of the cache key so that a modified file
+    is probed again. Only attributes, encodings and dimension coordinates
+    are read, variable data is never loaded.
+    """
+    if not is_netcdf(path):
+        return {'is_nc': False}
+    try:
+        with _xr.open_dataset(path, engine='netcdf4') as ds:
+            return {
+                'is_nc': True,
+                'complevels': tuple(v.encoding.get('complevel', 0)
+                                    for v in ds.variables.values()),
+                'precision': ds.attrs.get('precision'),
+                'has_regrid_attr': 'regrid_method' in ds.attrs,
+                'dims': tuple(ds.dims),
+                'coords': {k: ds[k].values for k in ds.dims}}
+    except OSError:
+        return {'is_nc': False}
+
+
+def _probe_file(f):
+    """Return cached header information of file f."""
+    try:
+        st = _stat(f)
+    except OSError:
+        return {'is_nc': False}
+    return _probe(str(f), st.st_mtime_ns, st.st_size)
+
 
 def _update_is_required_compress(f, quantize=2, dlevel=5):
     """Check NetCDF file is compressed or not."""
-    dp_str = 'precision'
-    compression_changed = False
-    with _xr.open_dataset(f, engine='netcdf4') as ds:
-        for _, v in ds.variables.items():
-            if v.encoding['complevel'] != dlevel:
-                compression_changed = True
-                break
-        if dp_str in ds.attrs.keys():
-            if ds.attrs[dp_str] is not None and quantize is not None:
-                if quantize >= ds.attrs[dp_str]:
-                    quantize = None
-        if quantize is not None:
-            compression_changed = True
+    info = _probe_file(f)
+    if not info['is_nc']:
+        return True
+    compression_changed = any(i != dlevel for i in info['complevels'])
+    precision = info['precision']
+    if precision is not None and quantize is not None:
+        if quantize >= precision:
+            quantize = None
+    if quantize is not None:
+        compression_changed = True
     return compression_changed
 
 
 def _update_is_required_regrid(f, lats, lons, dim_names=None):
     """Check NetCDF file is regridded previously."""
-    with _xr.open_dataset(f, engine='netcdf4') as ds:
-        latn, lonn = _find_dim_names(ds) if dim_names is None \
-                     else tuple(dim_names)
-        if 'regrid_method' in ds.attrs.keys():  # if contains attribute
-            xlats, xlons = ds[latn].values, ds[lonn].values
-            if all(xlats != lats):
-                return True
-            if all(xlons != lons):
-                return True
-        else:
-            return True
+    info = _probe_file(f)
+    if not info['is_nc'] or not info['has_regrid_attr']:
+        return True
+    lats, lons = _np.asarray(lats), _np.asarray(lons)
+    latn, lonn = _find_dim_names(info['dims']) if dim_names is None \
+        else tuple(dim_names)
+    xlats, xlons = info['coords'][latn], info['coords'][lonn]
+    if xlats.shape != lats.shape or not _np.array_equal(xlats, lats):
+        return True
+    if xlons.shape != lons.shape or not _np.array_equal(xlons, lons):
+        return True
     return False
 
 
-def _set_logger_(name, verbose=False,
-                 log_level='INFO', logfile=None) -> None:
+def _set_logger_(name, verbose=False,  # pylint: disable=R0913
+                 log_level='INFO', logfile=None, buffered=True) -> None:
+    for handler in list(_log.handlers):
+        _log.removeHandler(handler)
+        handler.close()
     _log.name = name
     _log.setLevel(_log_levels_[log_level])
     if verbose:
-        handler = _logging.StreamHandler()
-        handler.setFormatter(_log_formatter_)
+        stream = _logging.StreamHandler()
+        stream.setFormatter(_log_formatter_)
+        handler = stream
+        if buffered:
+            # buffer debug records; INFO and above flush immediately
+            handler = _MemoryHandler(256, flushLevel=_logging.INFO,
+                                     target=stream)
         _log.addHandler(handler)
     if logfile is not None:
-        handler = _logging.FileHandler(logfile)
+        # the log file is shared with CLI pool workers; lock it if possible
+        handler = _logging.FileHandler(logfile) \
+            if _ConcurrentFileHandler is None \
+            else _ConcurrentFileHandler(logfile)
         handler.setFormatter(_log_formatter_)
         _log.addHandler(handler)
     return _log
 
 
+def _set_threads_(n=None) -> None:
+    """Limit threads used inside a process (numba kernels, ncks stats)."""
+    global _threads_  # pylint: disable=W0603
+    _threads_ = n
+    if _numba is not None:
+        _numba.set_num_threads(n or _numba.config.NUMBA_NUM_THREADS)
+
+
+def _as_set(x):
+    """Return variable names x (None, str or iterable) as a frozenset."""
+    if isinstance(x, frozenset):
+        return x
+    if isinstance(x, str):
+        return frozenset((x,))
+    return frozenset(x or ())
+
+
 def _check_ds(ds) -> None:
     ds_types = (_xr.core.dataset.Dataset,
                 _xr.core.dataarray.DataArray,
@@ -112,29 +225,310 @@ def _check_dlevel(x) -> None:
             raise ValueError('dlevel must be between (0,9)')
 
 
-def _exp10(x):
-    return max(10**(-_floor(_log10(x))) if x > 0 else 1, 1)
+def _check_algo(x) -> None:
+    if x not in _algo_names_:
+        names = ', '.join(f"'{i}'" for i in _algo_names_)
+        raise ValueError(f'algo must be one of {names}')
+
+
+def _pick_chunks(da):
+    """
+    Return on-disk chunk sizes for a variable.
+
+    A chunk holds one 2-D plane of the last two dimensions when the plane
+    is at least _chunk_min_bytes_; otherwise outer dimensions (innermost
+    first) are added until the chunk is about _chunk_bytes_. Planes (or
+    1-D variables) larger than _chunk_bytes_ are split evenly along their
+    outer dimension, and along the last one if a single row is too large.
+
+    Args:
+        da (xarray.Variable, xarray.DataArray or netCDF4.Variable) :
+            Variable to chunk.
+    Return:
+        tuple of chunk sizes or None if the variable cannot be chunked.
+    """
+    shape = da.shape
+    dtype = _np.dtype(getattr(da, 'encoding', {}).get('dtype', da.dtype))
+    if not shape or dtype.kind in 'OU':
+        return None
+    chunks = [max(i, 1) for i in shape[-2:]]
+    for i, size in enumerate(chunks):  # keep chunks well below HDF5 limit
+        row = dtype.itemsize * int(_np.prod(chunks[i + 1:]))
+        n = -(-size * row // _chunk_bytes_)
+        chunks[i] = -(-size // n)
+    nbytes = dtype.itemsize * int(_np.prod(chunks))
+    outer = []
+    target = 0 if nbytes >= _chunk_min_bytes_ else _chunk_bytes_
+    for size in reversed(shape[:-2]):
+        c = min(max(size, 1), max(target // nbytes, 1))
+        nbytes *= c
+        outer.insert(0, c)
+    chunks = tuple(outer + chunks)
+    if any(c > max(s, 1) for c, s in zip(chunks, shape)):
+        _log.warning(f'Chunk sizes {chunks} do not fit {shape}. '
+                     'Using library defaults.')
+        return None
+    return chunks
+
+
+def _compression_encoding(dlevel, algo='zstd', da=None):
+    """
+    Return variable encoding for compression.
+
+    Falls back to zlib if the filter of algo is not available in netCDF4
+    or the variable (da) is too small for blosc (zstd, lz4). Chunk sizes are
+    chosen by _pick_chunks if da is given.
+    """
+    if not _algo_available_[algo]:
+        _log.debug(f'{algo} filter is not available. Using zlib.')
+        algo = 'zlib'
+    if algo != 'zlib' and da is not None and \
+            _np.prod(da.shape) * _np.dtype(da.dtype).itemsize \
+            < _blosc_min_bytes_:
+        algo = 'zlib'
+    enc = {'zlib': algo == 'zlib', 'compression': _algo_names_[algo],
+           'complevel': dlevel, 'shuffle': True, 'contiguous': False}
+    chunks = _pick_chunks(da) if da is not None else None
+    if chunks is not None:
+        enc['chunksizes'] = chunks
+    return enc
+
+
+def _grid_hash(method, *coords):
+    """Return md5 hex digest of regridding method and grid coordinates."""
+    h = _md5(method.encode())
+    for x in coords:
+        x = _np.ascontiguousarray(x)
+        h.update(str((x.dtype.str, x.shape)).encode())
+        h.update(x.tobytes())
+    return h.hexdigest()
+
+
+def _get_regridder(ds, ds2, method):
+    """
+    Return a xesmf.Regridder from ds grid to ds2 grid.
+
+    Regridders are cached in memory and their weights are stored in
+    _weights_dir_ (unless it is None) so that later runs can reuse them.
+    Failing to store the weights is not an error.
+    """
+    key = _grid_hash(method, ds['lat'].values, ds['lon'].values,
+                     ds2['lat'].values, ds2['lon'].values)
+    regridder = _regridders_.get(key)
+    if regridder is not None:
+        return regridder
+    filename = None if _weights_dir_ is None else \
+        _join(_weights_dir_, f'weights_{key}.nc')
+    if filename is not None and _isfile(filename):
+        regridder = _xe.Regridder(ds, ds2, method, periodic=True,
+                                  filename=filename, reuse_weights=True)
+    else:
+        regridder = _xe.Regridder(ds, ds2, method, periodic=True)
+        if filename is not None:
+            tmp = f'{filename}.{_getpid()}.tmp'
+            try:
+                _makedirs(_weights_dir_, exist_ok=True)
+                regridder.to_netcdf(tmp)
+                _replace(tmp, filename)
+                _log.debug(f'Regridding weights saved to {filename}')
+            except OSError as e:
+                _log.debug(f'Regridding weights were not saved: {e}')
+                try:
+                    _remove(tmp)
+                except OSError:
+                    pass
+    _regridders_[key] = regridder
+    return regridder
+
+
+def _nsb(quantize):
+    """Number of mantissa bits to keep for quantize significant digits."""
+    return max(_ceil(quantize * _log2(10)) + 1, 1)
+
+
+def _bitround_consts(dtype, nsb):
+    """
+    Return BitRound constants for float dtype as its unsigned int type.
+
+    Returns (shift, half - 1, mask, exponent mask) or None if all mantissa
+    bits are kept.
+    """
+    info = _np.finfo(dtype)
+    shift = info.nmant - nsb
+    if shift <= 0:
+        return None
+    bits = info.bits
+    ut = _np.dtype(f'uint{bits}').type
+    return (ut(shift), ut((1 << (shift - 1)) - 1),
+            ut(~((1 << shift) - 1) & ((1 << bits) - 1)),
+            ut(((1 << info.nexp) - 1) << info.nmant))
+
+
+if _numba is not None:
+    @_numba.njit(parallel=True, fastmath=True, cache=True)
+    def _quantize_nb(x, xi, q, qi,  # pylint: disable=R0913
+                     shift, half, mask, exp_mask):
+        """
+        BitRound kernel writing x into q and returning the MAE.
+
+        xi and qi are unsigned int views of x and q. The error is reduced
+        in a second loop since q must not be read through its alias while
+        qi is being written.
+        """
+        one = xi.dtype.type(1)
+        for i in _numba.prange(xi.size):  # pylint: disable=E1133
+            v = xi[i]
+            if v & exp_mask != exp_mask:  # skip NaN/Inf
+                v = (v + half + ((v >> shift) & one)) & mask
+            qi[i] = v
+        mae = 0.0
+        for i in _numba.prange(x.size):  # pylint: disable=E1133
+            if xi[i] & exp_mask != exp_mask:
+                mae = max(mae, abs(x[i] - q[i]))
+        return mae
+
+
+def _bitround(a, nsb):
+    """
+    Round mantissa of a float array to nsb bits in-place (BitRound).
+
+    NumPy counterpart of _quantize_nb, used by _quantize without numba.
+
+    Args:
+        a (numpy.ndarray) : C-contiguous float array.
+        nsb (INT)         : Number of mantissa bits to keep.
+    Return:
+        numpy.ndarray (a itself)
+    Examples:
+        >>> _bitround(_np.array(3.14159), 8)
+        array(3.140625)
+        >>> _bitround(_np.array([_np.nan, -_np.inf, 3.14159], 'f4'), 8)
+        array([     nan,     -inf, 3.140625], dtype=float32)
+    """
+    consts = _bitround_consts(a.dtype, nsb)
+    if consts is None:
+        return a
+    shift, half, mask, _ = consts
+    # work on a 1-d view; ufuncs return scalars (not views) for 0-d arrays
+    flat = a.reshape(-1)
+    ui = flat.view(f'uint{a.itemsize * 8}')
+    ut = ui.dtype.type
+    finite = _np.isfinite(flat)
+    # round-to-nearest-even bias: half of the dropped bits - 1 + lowest kept
+    bias = _np.right_shift(ui, shift)
+    _np.bitwise_and(bias, ut(1), out=bias)
+    _np.add(bias, half, out=bias)
+    _np.add(ui, bias, out=ui, where=finite)
+    _np.bitwise_and(ui, mask, out=ui, where=finite)
+    return a
+
+
+def _quantize(x, nsb):
+    """
+    Quantize a float array by BitRound and measure the error in one pass.
+
+    With numba, a single fused kernel rounds and accumulates the error.
+    Otherwise the array is processed in slabs so that temporaries stay
+    small.
+
+    Args:
+        x (numpy.ndarray) : float array.
+        nsb (INT)         : Number of mantissa bits to keep.
+    Return:
+        tuple of quantized copy of x and maximum absolute error
+    """
+    fx = _np.ascontiguousarray(x).reshape(-1)
+    consts = _bitround_consts(fx.dtype, nsb)
+    if consts is None:
+        return _np.array(x, order='C'), 0.0
+    if _numba is not None:
+        q = _np.empty_like(fx)
+        ut = f'uint{fx.itemsize * 8}'
+        mae = _quantize_nb(fx, fx.view(ut), q, q.view(ut), *consts)
+        return q.reshape(_np.shape(x)), float(mae)
+    q = fx.copy()
+    step = max(_slab_bytes_ // q.itemsize, 1)
+    mae = 0.0
+    for i in range(0, q.size, step):
+        qs = _bitround(q[i:i + step], nsb)
+        with _np.errstate(invalid='ignore'):  # inf - inf
+            d = _np.subtract(fx[i:i + step], qs)
+        _np.abs(d, out=d)
+        mae = _np.fmax(mae, _np.fmax.reduce(d))
+    return q.reshape(_np.shape(x)), float(mae)
+
+
+def _quantize_blocks(a, nsb):
+    """
+    Quantize a dask array block by block (See _quantize).
+
+    The MAE is reduced over blocks in one pass. The quantized array stays
+    lazy and is computed again block by block when it is written, so
+    memory use is per block rather than per variable.
+
+    Args:
+        a (dask.array.Array) : float array.
+        nsb (INT)            : Number of mantissa bits to keep.
+    Return:
+        tuple of lazily quantized a and maximum absolute error
+    """
+    ones = tuple((1,) * len(c) for c in a.chunks)
+    mae = a.map_blocks(
+        lambda b: _np.full((1,) * b.ndim, _quantize(b, nsb)[1]),
+        chunks=ones, dtype='float64').max().compute()
+    q = a.map_blocks(lambda b: _quantize(b, nsb)[0], dtype=a.dtype)
+    return q, float(mae)
+
+
+def _slabs(var):
+    """
+    Yield index tuples covering a variable slab by slab.
 
+    Slabs are cut along the leading dimension, about _slab_bytes_ in size
+    and aligned to on-disk chunks of a netCDF4.Variable.
 
-def _exp10_2(x):
-    return 10**(-_np.floor(_np.log10(x)))
+    Args:
+        var (netCDF4.Variable|numpy.ndarray) : Variable to iterate.
+    """
+    if var.ndim == 0:
+        yield ()
+        return
+    n = var.shape[0]
+    row = int(_np.prod(var.shape[1:])) * _np.dtype(var.dtype).itemsize
+    step = max(_slab_bytes_ // max(row, 1), 1)
+    chunks = var.chunking() if hasattr(var, 'chunking') else None
+    if isinstance(chunks, (list, tuple)):
+        step = max(step // chunks[0], 1) * chunks[0]
+    for i in range(0, n, step):
+        yield (slice(i, min(i + step, n)),)
 
 
 def is_netcdf(f):
     """
-    Check file is a valid netcdf file.
+    Check file is a netcdf file by its signature (HDF5 or classic).
 
     Args:
     f (FILENAME): A valid file name
     """
     try:
-        _xr.open_dataset(f, engine='netcdf4')
+        with open(f, 'rb') as fp:
+            head = fp.read(8)
     except OSError:
         return False
-    return True
+    return head.startswith(_nc_magic_)
 
 
-def scale_ncdf(nco, factor, variables=None, exclude_variables=('TFLAG',)):
+def is_valid_netcdf(f):
+    """
+    Check file is a valid netcdf file by opening it.
+
+    Args:
+    f (FILENAME): A valid file name
+    """
+    return _probe_file(f)['is_nc']
+
+
+def scale_ncdf(nco, factor, variables=None, exclude_variables=_exclude_vars_):
     """
     Scale netCDF4.Dataset object.
 
@@ -147,29 +541,34 @@ def scale_ncdf(nco, factor, variables=None, exclude_variables=('TFLAG',)):
     Return:
         netCDF4.Dataset object
     """
-    try:
-        from netCDF4 import Dataset as _Dataset  # pylint: disable=E0611,C0415
-        if not isinstance(nco, _Dataset):
-            raise TypeError("nco must be an instance of 'netCDF4.Dataset'")
-    except ImportError:
-        print('Install netCDF4 library to use this functionality')
-        return None
+    if _nc4_Dataset is None:
+        raise ImportError('Install netCDF4 library to use this functionality')
+    if not isinstance(nco, _nc4_Dataset):
+        raise TypeError("nco must be an instance of 'netCDF4.Dataset'")
 
-    nco_vars = list(nco.variables.keys())
+    exclude_variables = _as_set(exclude_variables)
+    nco_vars = nco.variables
     if variables is None:
-        variables = nco_vars
+        variables = list(nco_vars)
     for k in variables:
         if k not in nco_vars:
             _log.debug(f'Var:{k} was not found in dataset. Skipping!')
             continue
         if k not in exclude_variables:
-            nco[k][:] *= factor
+            v = nco_vars[k]
+            for sl in _slabs(v):
+                buf = _np.asanyarray(v[sl])
+                f = buf.dtype.type(factor) if buf.dtype.kind == 'f' \
+                    else factor
+                _np.multiply(buf, f, out=buf)
+                v[sl] = buf
             _log.debug(f'{k} variable scaled by {factor}')
     return nco
 
 
-def scale_xr(ds, factor, variables=None, exclude_variables=('TFLAG',),
-             dlevel=5):
+def scale_xr(ds, factor, variables=None,  # pylint: disable=R0913
+             exclude_variables=_exclude_vars_, dlevel=5, algo='zstd',
+             significant_digits=None, storage_dtype=None):
     """
     Scale NetCDF File by xarray library.
 
@@ -180,11 +579,23 @@ def scale_xr(ds, factor, variables=None, exclude_variables=('TFLAG',),
         exclude_vars (str| list) : Name of variables to exclude from scaling.
         dlevel (INT)             : Compression/deflate level between [0-9].
                                    Default is 5.
+        algo (str)               : Compression algorithm; 'zstd', 'lz4' or
+                                   'zlib'. Default is 'zstd'.
+        significant_digits (INT) : Quantize scaled data to significant
+                                   digits (See compress). Default is None.
+        storage_dtype (str)      : Data type of scaled variables in file,
+                                   e.g. 'float32'. Default is the dtype of
+                                   scaled data (float32 stays float32).
     Return:
         xarray.Dataset object.
     """
     _check_dlevel(dlevel)
-    ds = ds.copy(deep=True)
+    _check_algo(algo)
+    _check_int(significant_digits, 'significant_digits')
+    if storage_dtype is not None:
+        storage_dtype = _np.dtype(storage_dtype)
+    exclude_variables = _as_set(exclude_variables)
+    ds = ds.copy(deep=False)
     if variables is None:
         variables = list(ds.variables)
     # log.debug(f'Scaling {from_file}')
@@ -193,21 +604,27 @@ def scale_xr(ds, factor, variables=None, exclude_variables=('TFLAG',),
             _log.debug(f'Var:{k} was not found in dataset. Skipping!')
             continue
         if k not in exclude_variables:
-            encoding, attrs = ds[k].encoding, ds[k].attrs
-            ds[k] = ds[k].astype('float64') * factor
-            ds[k].encoding, ds[k].attrs = encoding, attrs
+            encoding = ds[k].encoding
+            # float data is scaled in its own precision, others in float64
+            dt = ds[k].dtype if ds[k].dtype.kind == 'f' \
+                else _np.dtype('float64')
+            ds[k] = _xr.apply_ufunc(_np.multiply, ds[k], dt.type(factor),
+                                    dask='allowed', keep_attrs=True)
+            encoding['dtype'] = storage_dtype or ds[k].dtype
+            ds[k].encoding = encoding
             _log.debug(f'{k} variable scaled by {factor}')
-            ds[k].attrs['scale_factor'] = factor
+    if significant_digits is not None:
+        ds = compress(ds, significant_digits, None)
     if dlevel is not None:
         for k in ds.keys():
             ds[k].encoding.update(
-                {'dtype': _np.dtype('float32'), 'zlib': True,
-                 'complevel': dlevel})
+                _compression_encoding(dlevel, algo, ds[k]))
 
     return ds
 
 
-def scale_emis(ds, factor, dlevel=5):
+def scale_emis(ds, factor, dlevel=5,  # pylint: disable=R0913
+               algo='zstd', significant_digits=None, storage_dtype=None):
     """
     Scale emission File by xarray library.
 
@@ -216,81 +633,75 @@ def scale_emis(ds, factor, dlevel=5):
         factor (FLOAT)           : Scale factor.
         dlevel (INT)             : Compression/deflate level between [0-9].
                                    Default is 5.
+        algo (str)               : Compression algorithm; 'zstd', 'lz4' or
+                                   'zlib'. Default is 'zstd'.
+        significant_digits (INT) : Quantize scaled data to significant
+                                   digits (See compress). Default is None.
+        storage_dtype (str)      : Data type of scaled variables in file.
+                                   Default is the dtype of scaled data.
     Return:
         xarray.Dataset object.
     """
     return scale_xr(ds, factor,
                     file._emis_vars_,  # pylint: disable=W0212
                     file._exclude_vars_,  # pylint: disable=W0212
-                    dlevel)
+                    dlevel, algo, significant_digits, storage_dtype)
 
 
-def compress(ds, quantize=None, dlevel=5):  # pylint: disable=R0912
+def compress(ds, quantize=None, dlevel=5,  # pylint: disable=R0912
+             algo='zstd'):
     """
     Compress a single NetCDF File.
 
     Args:
         ds (xarray.Dataset)  : xarray.Dataset object
-        quantize (INT)       : Decimal precision to truncate data.
+        quantize (INT)       : Number of significant decimal digits to
+                               keep by rounding mantissa bits (BitRound).
                                Default is no quantization.
         dlevel (INT)         : Compression/deflate level between [0-9].
                                Default is 5.
+        algo (str)           : Compression algorithm; 'zstd', 'lz4' or
+                               'zlib'. Default is 'zstd'.
     Return:
         xarray.Dataset object.
     """
     _check_ds(ds)
     _check_int(quantize, 'quantize')
     _check_dlevel(dlevel)
+    _check_algo(algo)
     pm_str = 'precision_MAE'
     if isinstance(ds, _xr.core.variable.Variable):
-        dt = ds.dtype
         old_enc = ds.encoding.copy()
         if str(ds.dtype).startswith('float') and quantize is not None:
-            q = 0.0
-            mx = ds.max().values.tolist()
-            mn = ds.min().values.tolist()
-            # if (ds != 0.0).all():
-            #     m = ds.where(ds != 0.0)
-            #     mx, mn = m.max().values.tolist(), m.min().values.tolist()
-            #     q = m.quantile(q=0.90).values.tolist()
-            #     q = m.mean().values.tolist()
-            #     q = m.max().values.tolist()
-            #     e = _exp10_2(abs(m))
-            #     e = stats.mode(e)
-            #     vals, counts = _np.unique(e, return_counts=True)
-            #     index = _np.argmax(counts)
-            #     e = vals[index]
-            #     print(e)
-            # e = _exp10(abs(q))
-            e = 1
-            _log.debug(f'Max: {mx}, Min: {mn}, exp: {e}, q: {q}')
-            e = _np.array(e).astype('float64')
-            r = (_np.round(ds.astype('float64') * e, quantize) / e).astype(dt)
-            mae = _np.max(abs(ds - r)).astype(dt)
-            r.attrs[pm_str] = mae.values.tolist()
-            ds = r
+            nsb = _nsb(quantize)
+            _log.debug(f'quantize: {quantize}, keep mantissa bits: {nsb}')
+            if ds.chunks is None:
+                q, mae = _quantize(ds.values, nsb)
+            else:
+                q, mae = _quantize_blocks(ds.data, nsb)
+            ds = ds.copy(data=q)
+            ds.attrs[pm_str] = mae
         if dlevel is not None:
-            old_enc.update({'zlib': True, 'shuffle': True,
-                            'complevel': dlevel})
+            old_enc.update(_compression_encoding(dlevel, algo, ds))
             ds.encoding = old_enc
 
     if isinstance(ds, _xr.core.dataarray.DataArray):
-        v = compress(ds.variable, quantize, dlevel)
+        v = compress(ds.variable, quantize, dlevel, algo)
         ds = _xr.DataArray(v, name=ds.name, attrs=v.attrs)
         ds.encoding = v.encoding.copy()
         if pm_str in ds.attrs.keys():
             _log.debug(f'Processed {ds.name}: MAE: {ds.attrs[pm_str]}')
 
     if isinstance(ds, _xr.core.dataarray.Dataset):
-        ds2 = ds.copy(deep=True)
+        ds2 = ds.copy(deep=False)
         glob_mae = 0
         for k in list(ds2.keys()):
-            ds2[k] = compress(ds2[k], quantize, dlevel)
+            ds2[k] = compress(ds2[k], quantize, dlevel, algo)
             if pm_str in ds2[k].attrs.keys():
                 glob_mae = max(glob_mae, ds2[k].attrs[pm_str])
 
         if quantize is not None:
-            ds2.attrs.update({'decimal_precision': quantize,
+            ds2.attrs.update({'significant_digits': quantize,
                               pm_str: glob_mae})
             _log.info(f'{pm_str}: {glob_mae}')
         return ds2
@@ -302,26 +713,32 @@ def _find_dim_names(ds, lat_name='lat', lon_name='lon'):
     Find exact lat/lon dimension names in xarray dataset.
 
     Args:
-        ds (xarray.Dataset) : xarray Dataset object
-        lat_name (str)      : lat name to search in coords.
-        lon_name (str)      : lon name to search in coords.
+        ds (xarray.Dataset|tuple) : xarray Dataset object or dimension names.
+        lat_name (str)            : lat name to search in coords.
+        lon_name (str)            : lon name to search in coords.
     Return:
         tuple of lat/lon names
     """
-    dim_names = list(ds.dims.keys())
-    coord = {}
-    for j in [lat_name, lon_name]:
-        dim_name = {j: i for i in dim_names if j in i}
-        if len(dim_name) == 0:
+    dim_names = tuple(ds.dims if hasattr(ds, 'dims') else ds)
+    return _match_dim_names(dim_names, lat_name, lon_name)
+
+
+@_lru_cache(maxsize=256)
+def _match_dim_names(dim_names, lat_name, lon_name):
+    """Match lat/lon names in a tuple of dimension names (cached per grid)."""
+    coord = []
+    for j in (lat_name, lon_name):
+        hits = [i for i in dim_names if j in i]
+        if len(hits) == 0:
             raise ValueError(f'dimension {j} name was not found')
-        if len(dim_name) > 1:
+        if len(hits) > 1:
             raise ValueError(f'Ambiguous dimension name for {j}')
-        coord.update(dim_name)
-    return coord[lat_name], coord[lon_name]
+        coord.append(hits[0])
+    return tuple(coord)
 
 
 def regrid(ds, lats, lons, dim_names=None,  # pylint: disable=R0913
-           dlevel=5, method='bilinear'):
+           dlevel=5, method='bilinear', algo='zstd'):
     """
     Regrid xarray dataset.
 
@@ -333,15 +750,15 @@ def regrid(ds, lats, lons, dim_names=None,  # pylint: disable=R0913
         dlevel (INT)           : Compression/deflate level between [0-9].
                                  Default is 5.
         method (str)           : regridding method. (See xesmf.Regridder)
+        algo (str)             : Compression algorithm; 'zstd', 'lz4' or
+                                 'zlib'. Default is 'zstd'.
     Return:
         xarray.Dataset object
     """
-    # try:
-    import xesmf as xe  # pylint: disable=E0401,C0415
-    # except ImportError:
-    #     print('*** Install xesmf library to use this functionality ***')
-    #     return None
+    if _xe is None:
+        raise ImportError('Install xesmf library to use this functionality')
     _check_dlevel(dlevel)
+    _check_algo(algo)
     latn, lonn = _find_dim_names(ds) if dim_names is None else tuple(dim_names)
     ds = ds.rename({latn: 'lat', lonn: 'lon'})
     ds2 = _xr.Dataset(
@@ -350,11 +767,11 @@ def regrid(ds, lats, lons, dim_names=None,  # pylint: disable=R0913
             "lon": (["lon"], lons),
         }
     )
-    regridder = xe.Regridder(ds, ds2, method, periodic=True)
+    regridder = _get_regridder(ds, ds2, method)
     ds2 = regridder(ds)
     if dlevel is not None:
         for k in ds2.keys():
+            ds2[k].encoding['dtype'] = _np.dtype('float32')
             ds2[k].encoding.update(
-                {'dtype': _np.dtype('float32'), 'zlib': True,
-                 'complevel': dlevel})
+                _compression_encoding(dlevel, algo, ds2[k]))
     return ds2
@@ -5,56 +5,78 @@ nchandy CLI Module.
 ~~~~~~~~~
 CLI module
 """
+from os import cpu_count as _cpu_count
 from os import getcwd as _getcwd
+from os import getpid as _getpid
 from os import makedirs as _makedirs
+from os import scandir as _scandir
+from os import stat as _stat
+from os.path import commonpath as _commonpath
 from os.path import isdir as _isdir
 from os.path import isfile as _isfile
 from os.path import split as _split
 from pathlib import Path as _Path
-from filecmp import cmp as _cmp
+from hashlib import blake2b as _blake2b
+from mmap import mmap as _mmap
+from mmap import ACCESS_READ as _ACCESS_READ
 from shutil import copy2 as _copy2
+from collections import deque as _deque
+from collections import namedtuple as _namedtuple
+from concurrent.futures import ProcessPoolExecutor as _ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor as _ThreadPoolExecutor
+from concurrent.futures import as_completed as _as_completed
 
 import functools
 import click
 
 from nchandy import __version__
 from nchandy import _log_level_names_
+from nchandy import _algo_names_
 from nchandy import _set_logger_
+from nchandy import _ConcurrentFileHandler
+from nchandy import _set_threads_
 from nchandy import is_netcdf as _is_netcdf
 from nchandy import _update_is_required_compress
 from nchandy import _update_is_required_regrid
 from nchandy import file as _file
+from nchandy.file import _log
 
 _cli_log_levels_ = click.Choice(_log_level_names_)
+_cli_algos_ = click.Choice(list(_algo_names_))
 _txt1_ = '%s is not a valid netcdf file. Copied to target.'
+_txt_xesmf_ = '*** Install xesmf library to use this functionality ***'
+_txt_ncks_ = '*** Install NCO (ncks) to use this functionality ***'
 
-
-def _common_start(sa, sb):
-    """Return the longest common substring from the beginning of sa and sb."""
-    def _iter():
-        for a, b in zip(sa, sb):
-            if a == b:
-                yield a
-            else:
-                return
-
-    return ''.join(_iter())
+_Task = _namedtuple('_Task', ['f1', 'f2', 'op', 'params'])
+_prefetch_depth_ = 32  # number of files read ahead in serial runs
+_header_bytes_ = 1 << 16  # bytes read ahead from the beginning of files
 
 
 def _get_source_dir(source):
     """Get source_dir from file names."""
-    source_dir = ''
-    if len(source) > 1:
-        source_dir = source[0]
-        for i in source[1:]:
-            source_dir = _common_start(source_dir, i)
-            if source_dir == '':
-                break
-        if not _isdir(source_dir):
-            source_dir, _ = _split(source_dir)
+    if len(source) < 2:
+        return ''
+    try:
+        source_dir = _commonpath(source)
+    except ValueError:  # mix of absolute and relative paths
+        return ''
+    if not _isdir(source_dir):
+        source_dir, _ = _split(source_dir)
     return source_dir
 
 
+def _walk(root, recursive=True):
+    """Yield paths of files with an extension (*.*) under root."""
+    with _scandir(root) as it:
+        for entry in it:
+            # like Path.rglob, do not recurse into symlinked directories
+            if entry.is_dir(follow_symlinks=False):
+                if recursive:
+                    yield from _walk(entry.path, recursive)
+            elif '.' in entry.name and not entry.is_dir():
+                yield entry.path
+
+
 def _get_file_args(paths, recursive=True):
     """Get file/path arguments."""
     if isinstance(paths, str):
@@ -73,8 +95,7 @@ def _get_file_args(paths, recursive=True):
     if not isinstance(source, (list, tuple)):
         if _isdir(source):
             source_dir = _Path(source)
-            source = list(source_dir.rglob("*.*") if recursive
-                          else source_dir.glob("*.*"))
+            source = list(_walk(source_dir, recursive))
         elif _isfile(source):
             source = [source]
         else:
@@ -91,13 +112,38 @@ def _get_file_args(paths, recursive=True):
     return source, _Path(source_dir), _Path(target)
 
 
+def _digest(f):
+    """Return blake2b digest of file contents."""
+    with open(f, 'rb') as fp, _mmap(fp.fileno(), 0, access=_ACCESS_READ) as m:
+        return _blake2b(m).digest()
+
+
+def _same_file(f1, f2, shallow=True):
+    """
+    Compare two files.
+
+    Files of different sizes differ. If shallow, files with the same size
+    and modification time (to the second) are equal. Otherwise contents
+    are compared by their blake2b digests.
+    """
+    s1, s2 = _stat(f1), _stat(f2)
+    if s1.st_size != s2.st_size:
+        return False
+    if s1.st_size == 0:
+        return True
+    if shallow and int(s1.st_mtime) == int(s2.st_mtime):
+        return True
+    return _digest(f1) == _digest(f2)
+
+
 def _get_f2(f1, source_dir, target):
-    if str(source_dir) == '.':
-        f2 = _Path(target, f1.name) if _isdir(target) else target
-    else:
-        f2 = target if str(source_dir) == '' else \
-            _Path(str(f1).replace(str(source_dir), str(target)))
-    return f2
+    """Get target file path of source file f1."""
+    if source_dir == _Path('.'):
+        return target / f1.name if _isdir(target) else target
+    try:
+        return target / f1.relative_to(source_dir)
+    except ValueError:
+        return target / f1.name
 
 
 class FilesDefaultToStdin(click.Argument):
@@ -142,6 +188,9 @@ def _common_options(func):
                   required=False, help='Logging level.')
     @click.option('--verbose', '-v', default=False,
                   is_flag=True, help='Show verbose output.')
+    @click.option('--jobs', '-j', default=0,
+                  help='Number of files processed in parallel. ' +
+                       '0 uses all CPUs.')
     @click.argument('paths', cls=FilesDefaultToStdin)
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
@@ -149,6 +198,162 @@ def _common_options(func):
     return wrapper
 
 
+def _scale(f1, f2, params):
+    _file.scale_xr(f1, params['factor'], dlevel=params['dlevel'], to_file=f2,
+                   algo=params['algo'],
+                   significant_digits=params['significant_digits'],
+                   storage_dtype=params['dtype'])
+
+
+def _regrid(f1, f2, params):
+    _file.regrid(f1, params['lats'], params['lons'], params['dim_names'],
+                 params['dlevel'], to_file=f2, algo=params['algo'])
+
+
+def _compress(f1, f2, params):
+    _file.compress(f1, params['quantize'], params['dlevel'], f2,
+                   params['algo'])
+
+
+def _ncks(f1, f2, params):
+    _file.ncks(f1, params['quantize'], params['dlevel'], f2, params['stats'])
+
+
+def _regrid_required(f2, params):
+    return _update_is_required_regrid(f2, params['lats'], params['lons'],
+                                      params['dim_names'])
+
+
+def _compress_required(f2, params):
+    return _update_is_required_compress(f2, params['quantize'],
+                                        params['dlevel'])
+
+
+# op: (update required check, worker, message if target is up to date)
+_ops_ = {'scale': (None, _scale, None),
+         'regrid': (_regrid_required, _regrid, 'already regridded'),
+         'compress': (_compress_required, _compress, 'already compressed'),
+         'ncks': (_compress_required, _ncks, 'already compressed')}
+
+
+def _process_one(task):
+    """Process a single source file."""
+    f1, f2, op, params = task
+    required, run, done = _ops_[op]
+    _makedirs(f2.parent, exist_ok=True)
+    if not _isfile(f1):
+        return
+    if not _is_netcdf(f1):
+        if _isfile(f2):
+            if _same_file(f1, f2):
+                _log.debug(f'Comparing {f1} with {f2}')
+                _log.debug(f"{f1} is identical to target.")
+        elif params['copy_non_nc_files']:
+            _copy2(f1, f2)
+            _log.debug(_txt1_, f1)
+        return
+
+    process = True
+    if _isfile(f2):
+        if _is_netcdf(f2):
+            process = required is None or required(f2, params)
+            if not process:
+                _log.info(f"{f2} is {done}.")
+            elif not params['overwrite']:
+                raise FileExistsError('Use --overwrite to overwrite files')
+        else:
+            process = False
+            if params['copy_non_nc_files']:
+                _copy2(f1, f2)
+                _log.debug(_txt1_, f1)
+
+    if process:
+        run(f1, f2, params)
+
+
+def _read_headers(*files):
+    """Read the beginning of files into the OS page cache."""
+    for f in files:
+        try:
+            with open(f, 'rb') as fp:
+                fp.read(_header_bytes_)
+        except OSError:
+            pass
+
+
+def _prefetched(tasks):
+    """
+    Yield tasks while headers of the next ones are read in background.
+
+    Only raw bytes are read in threads; netCDF-C is not thread-safe, so
+    the files are still probed and processed in the calling thread.
+    """
+    pending = _deque()
+    with _ThreadPoolExecutor(max_workers=16) as executor:
+        for task in tasks:
+            pending.append(
+                (task, executor.submit(_read_headers, task.f1, task.f2)))
+            if len(pending) >= _prefetch_depth_:
+                task, future = pending.popleft()
+                future.result()
+                yield task
+        while pending:
+            task, future = pending.popleft()
+            future.result()
+            yield task
+
+
+def _get_tasks(paths, recursive, op, params):
+    """Return a task per source file."""
+    if len(paths) == 0:
+        paths = tuple([_getcwd()])
+    source, source_dir, target = _get_file_args(paths, recursive)
+    return [_Task(f1, _get_f2(f1, source_dir, target), op, params)
+            for f1 in source]
+
+
+def _init_worker(name, verbose, log_level, logfile):
+    """Set up logging and single-threaded kernels in a pool worker."""
+    if logfile is not None and _ConcurrentFileHandler is None:
+        logfile = f'{logfile}.{_getpid()}'  # no lock to share the file
+    # workers exit by os._exit, so buffered records would never be flushed
+    _set_logger_(name, verbose, log_level, logfile, buffered=False)
+    _set_threads_(1)
+
+
+def _process_many(tasks):
+    """Process a chunk of tasks in a pool worker."""
+    for task in tasks:
+        _process_one(task)
+
+
+def _run_tasks(tasks, jobs, logger_args):
+    """Run tasks serially or on a process pool if jobs != 1."""
+    jobs = jobs or _cpu_count()
+    if len(tasks) < 2:
+        for task in tasks:
+            _process_one(task)
+        return
+    if jobs == 1:
+        for task in _prefetched(tasks):
+            _process_one(task)
+        return
+    chunksize = min(8, -(-len(tasks) // jobs))
+    for handler in _log.handlers:  # do not copy buffered records to workers
+        handler.flush()
+    with _ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                              initargs=logger_args) as executor:
+        futures = [executor.submit(_process_many, tasks[i:i + chunksize])
+                   for i in range(0, len(tasks), chunksize)]
+        try:
+            for future in _as_completed(futures):
+                future.result()
+        except BaseException:
+            for future in futures:  # stop at the first error
+                future.cancel()
+            raise
+
+
 @click.group()
 def cli():
     """Nchandy CLI."""
@@ -163,10 +368,21 @@ def version_cmd() -> None:
 @cli.command("scale", short_help="Scale NetCDF File(s)",
              context_settings={'show_default': True})
 @click.argument('factor', type=float, required=True)
+@click.option('--significant-digits', '-s', type=int, default=None,
+              help='Quantize scaled data to a given number of ' +
+                   'significant digits, e.g. -s 2.')
+@click.option('--dtype', '-t', default=None,
+              type=click.Choice(['float32', 'float64']),
+              help='Storage data type of scaled variables. ' +
+                   'Default is the data type of the input.')
+@click.option('--algo', '-a', type=_cli_algos_, default='zstd',
+              help='Compression algorithm. Falls back to zlib if the ' +
+                   'filter is not available.')
 @_common_options
-def scale_cmd(paths, factor, recursive,  # pylint: disable=R0912,R0913,R0914
+def scale_cmd(paths, factor,  # pylint: disable=R0913
+              significant_digits, dtype, algo, recursive,
               copy_non_nc_files, dlevel, overwrite,
-              log, log_level, verbose) -> None:  # noqa:D301
+              log, log_level, verbose, jobs) -> None:  # noqa:D301
     """
     Scale NetCDF File(s) by factor of a floating number.
 
@@ -182,45 +398,13 @@ def scale_cmd(paths, factor, recursive,  # pylint: disable=R0912,R0913,R0914
         $ nch scale -v 0.2 path/to/nc_files /target/dir
         $ nch scale -v 0.4 path/to/nc_files
     """
-    _log = _set_logger_('scale', verbose, log_level, log)
-    if len(paths) == 0:
-        paths = tuple([_getcwd()])
-
-    source, source_dir, target = _get_file_args(paths, recursive)
-
-    for f1 in source:
-        f2 = _get_f2(f1, source_dir, target)
-        _makedirs(f2.parent, exist_ok=True)
-        scale = False
-        if _isfile(f1):
-            if not _is_netcdf(f1):
-                if _isfile(f2):
-                    if _cmp(f1, f2):
-                        _log.debug(f'Comparing {f1} with {f2}')
-                        msg = f"{f1} is identical to target."
-                        _log.debug(msg)
-                else:
-                    if copy_non_nc_files:
-                        _copy2(f1, f2)
-                        _log.debug(_txt1_, f1)
-                scale = False
-                continue
-        else:
-            continue
-
-        if _isfile(f2):
-            if _is_netcdf(f2):
-                if not overwrite:
-                    raise FileExistsError('Use --overwrite to overwrite files')
-            else:
-                if copy_non_nc_files:
-                    _copy2(f1, f2)
-                    _log.debug(_txt1_, f1)
-        else:
-            scale = True
-
-        if scale:
-            _file.scale_xr(f1, factor, dlevel=dlevel, to_file=f2)
+    logger_args = ('scale', verbose, log_level, log)
+    _set_logger_(*logger_args)
+    params = {'factor': factor, 'significant_digits': significant_digits,
+              'dtype': dtype, 'dlevel': dlevel, 'algo': algo,
+              'overwrite': overwrite, 'copy_non_nc_files': copy_non_nc_files}
+    _run_tasks(_get_tasks(paths, recursive, 'scale', params),
+               jobs, logger_args)
 
 
 @cli.command("regrid", short_help="Regrid NetCDF File(s)",
@@ -234,10 +418,14 @@ def scale_cmd(paths, factor, recursive,  # pylint: disable=R0912,R0913,R0914
                    ' If this arg is defined, overrides lats/lons args.')
 @click.option('--dim_names', '-dn', default=None,
               required=False, nargs=2, help='latitude/longitude dim name.')
+@click.option('--algo', '-a', type=_cli_algos_, default='zstd',
+              help='Compression algorithm. Falls back to zlib if the ' +
+                   'filter is not available.')
 @_common_options
-def regrid_cmd(paths, lats, lons,  # pylint: disable=R0912,R0913,R0914
-               gridfile, dim_names, recursive, copy_non_nc_files, dlevel,
-               overwrite, log, log_level, verbose) -> None:  # noqa:D301
+def regrid_cmd(paths, lats, lons,  # pylint: disable=R0913,R0914
+               gridfile, dim_names, algo, recursive, copy_non_nc_files, dlevel,
+               overwrite, log, log_level, verbose,
+               jobs) -> None:  # noqa:D301
     """
     Regrid NetCDF File(s).
 
@@ -253,67 +441,33 @@ def regrid_cmd(paths, lats, lons,  # pylint: disable=R0912,R0913,R0914
         $ nch regrid -v -g gridcro.nc -d 0 path/to/nc_files /target/dir
         $ nch regrid -v -dn dim1 dim2 path/to/nc_files
     """
-    _log = _set_logger_('regrid', verbose, log_level, log)
-    if len(paths) == 0:
-        paths = tuple([_getcwd()])
-
-    source, source_dir, target = _get_file_args(paths, recursive)
-
+    logger_args = ('regrid', verbose, log_level, log)
+    _set_logger_(*logger_args)
     if gridfile is not None:
         raise NotImplementedError('This feature is not implemented yet.')
 
-    for f1 in source:
-        f2 = _get_f2(f1, source_dir, target)
-        _makedirs(f2.parent, exist_ok=True)
-        rg = False
-        if _isfile(f1):
-            if not _is_netcdf(f1):
-                if _isfile(f2):
-                    if _cmp(f1, f2):
-                        msg = f"{f1} is identical to target."
-                        _log.debug(msg)
-                else:
-                    if copy_non_nc_files:
-                        _copy2(f1, f2)
-                        _log.debug(_txt1_, f1)
-                rg = False
-                continue
-        else:
-            continue
-
-        if _isfile(f2):
-            if _is_netcdf(f2):
-                rg = _update_is_required_regrid(f2, lats, lons, dim_names)
-                if not rg:
-                    _log.info(f"{f2} is already regridded.")
-                elif not overwrite:
-                    raise FileExistsError('Use --overwrite to overwrite files')
-            else:
-                if copy_non_nc_files:
-                    _copy2(f1, f2)
-                    _log.debug(_txt1_, f1)
-
-        else:
-            rg = True
-
-        if rg:
-            try:
-                _file.regrid(f1, lats, lons, dim_names, dlevel, to_file=f2)
-            except ImportError:
-                msg = '*** Install xesmf library to use this functionality ***'
-                print(msg)
-                break
+    params = {'lats': lats, 'lons': lons, 'dim_names': dim_names,
+              'dlevel': dlevel, 'algo': algo, 'overwrite': overwrite,
+              'copy_non_nc_files': copy_non_nc_files}
+    try:
+        _run_tasks(_get_tasks(paths, recursive, 'regrid', params),
+                   jobs, logger_args)
+    except ImportError:
+        print(_txt_xesmf_)
 
 
 @cli.command("compress", short_help="Compress NetCDF file(s)",
              context_settings={'show_default': True})
 @click.option('--quantize', '-q', default=2,
-              help='Truncate data in variables to a given ' +
-                   'decimal precision after significant digit, e.g. -q 2.')
+              help='Number of significant decimal digits to keep in ' +
+                   'float variables, e.g. -q 2.')
+@click.option('--algo', '-a', type=_cli_algos_, default='zstd',
+              help='Compression algorithm. Falls back to zlib if the ' +
+                   'filter is not available.')
 @_common_options
-def compress_cmd(paths, quantize,  # pylint: disable=R0912,R0913,R0914
+def compress_cmd(paths, quantize, algo,  # pylint: disable=R0913
                  recursive, copy_non_nc_files, dlevel, overwrite,
-                 log, log_level, verbose) -> None:  # noqa:D301
+                 log, log_level, verbose, jobs) -> None:  # noqa:D301
     """
     Compress NetCDF File(s).
 
@@ -328,48 +482,12 @@ def compress_cmd(paths, quantize,  # pylint: disable=R0912,R0913,R0914
         $ nch compress -v -d 9 gridcro.nc -d 0 path/to/nc_files /target/dir
         $ nch compress -v -q 5 -d 9 path/to/nc_files
     """
-    _log = _set_logger_('compress', verbose, log_level, log)
-    if len(paths) == 0:
-        paths = tuple([_getcwd()])
-
-    source, source_dir, target = _get_file_args(paths, recursive)
-    for f1 in source:
-        f2 = _get_f2(f1, source_dir, target)
-        _makedirs(f2.parent, exist_ok=True)
-        print(source_dir, target, f2)
-        compress = False
-        if _isfile(f1):
-            if not _is_netcdf(f1):
-                if _isfile(f2):
-                    if _cmp(f1, f2):
-                        _log.debug(f'Comparing {f1} with {f2}')
-                        msg = f"{f1} is identical to target."
-                        _log.debug(msg)
-                else:
-                    if copy_non_nc_files:
-                        _copy2(f1, f2)
-                        _log.debug(_txt1_, f1)
-                compress = False
-                continue
-        else:
-            continue
-
-        if _isfile(f2):
-            if _is_netcdf(f2):
-                compress = _update_is_required_compress(f2, quantize, dlevel)
-                if not compress:
-                    _log.info(f"{f2} is already compressed.")
-                elif not overwrite:
-                    raise FileExistsError('Use --overwrite to overwrite files')
-            else:
-                if copy_non_nc_files:
-                    _copy2(f1, f2)
-                    _log.debug(_txt1_, f1)
-        else:
-            compress = True
-
-        if compress:
-            _file.compress(f1, quantize, dlevel, f2)
+    logger_args = ('compress', verbose, log_level, log)
+    _set_logger_(*logger_args)
+    params = {'quantize': quantize, 'dlevel': dlevel, 'algo': algo,
+              'overwrite': overwrite, 'copy_non_nc_files': copy_non_nc_files}
+    _run_tasks(_get_tasks(paths, recursive, 'compress', params),
+               jobs, logger_args)
 
 
 @cli.command("ncks", short_help="Compress NetCDF file(s) by nco->ncks command",
@@ -377,14 +495,14 @@ def compress_cmd(paths, quantize,  # pylint: disable=R0912,R0913,R0914
 @click.option('--quantize', '-q', default=2, type=str,
               help='Truncate data in variables to a given ' +
                    'decimal precision after significant digit, e.g. -q 2.')
-@click.option('--stats', '-s', default=False, is_flag=True, 
+@click.option('--stats', '-s', default=False, is_flag=True,
               help='Truncate data in variables to a given ' +
                    'decimal precision after significant digit, e.g. -q 2.')
 @_common_options
 def compress_ncks_cmd(
-    paths, quantize, stats, # pylint: disable=R0912,R0913,R0914
+    paths, quantize, stats, # pylint: disable=R0913
     recursive, copy_non_nc_files, dlevel, overwrite,
-    log, log_level, verbose) -> None:  # noqa:D301
+    log, log_level, verbose, jobs) -> None:  # noqa:D301
     """
     Compress NetCDF File(s).
 
@@ -399,47 +517,15 @@ def compress_ncks_cmd(
         $ nch ncks -v -q 5 gridcro.nc -d 0 path/to/nc_files /target/dir
         $ nch ncks -v -q 6 -d 9 path/to/nc_files
     """
-    _log = _set_logger_('compress', verbose, log_level, log)
-    if len(paths) == 0:
-        paths = tuple([_getcwd()])
-
-    source, source_dir, target = _get_file_args(paths, recursive)
-    for f1 in source:
-        f2 = _get_f2(f1, source_dir, target)
-        _makedirs(f2.parent, exist_ok=True)
-        compress = False
-        if _isfile(f1):
-            if not _is_netcdf(f1):
-                if _isfile(f2):
-                    if _cmp(f1, f2):
-                        _log.debug(f'Comparing {f1} with {f2}')
-                        msg = f"{f1} is identical to target."
-                        _log.debug(msg)
-                else:
-                    if copy_non_nc_files:
-                        _copy2(f1, f2)
-                        _log.debug(_txt1_, f1)
-                compress = False
-                continue
-        else:
-            continue
-
-        if _isfile(f2):
-            if _is_netcdf(f2):
-                compress = _update_is_required_compress(f2, quantize, dlevel)
-                if not compress:
-                    _log.info(f"{f2} is already compressed.")
-                elif not overwrite:
-                    raise FileExistsError('Use --overwrite to overwrite files')
-            else:
-                if copy_non_nc_files:
-                    _copy2(f1, f2)
-                    _log.debug(_txt1_, f1)
-        else:
-            compress = True
-
-        if compress:
-            _file.ncks(f1, quantize, dlevel, f2, stats)
+    if _file._ncks_ is None:  # pylint: disable=W0212
+        print(_txt_ncks_)
+        return
+    logger_args = ('compress', verbose, log_level, log)
+    _set_logger_(*logger_args)
+    params = {'quantize': quantize, 'dlevel': dlevel, 'stats': stats,
+              'overwrite': overwrite, 'copy_non_nc_files': copy_non_nc_files}
+    _run_tasks(_get_tasks(paths, recursive, 'ncks', params),
+               jobs, logger_args)
 
 
 def main() -> None:  # noqa: D401
@@ -6,78 +6,205 @@ nchandy Files Module.
 File module to interact with netCDF files directly
 """
 import logging as _logging
-from shutil import move as _mv
-from shutil import copy2 as _copy2
-from os import remove as _remove
+from os import fspath as _fspath
+from os import replace as _replace
 from pathlib import Path as _Path
-import subprocess as _subp
+from shutil import which as _which
+from subprocess import run as _run
+from subprocess import DEVNULL as _DEVNULL
+from subprocess import PIPE as _PIPE
+from subprocess import CalledProcessError as _CalledProcessError
+from importlib.util import find_spec as _find_spec
+from concurrent.futures import ProcessPoolExecutor as _ProcessPool
+from concurrent.futures import ThreadPoolExecutor as _ThreadPool
+from contextlib import contextmanager as _contextmanager
+from contextlib import nullcontext as _nullcontext
+from functools import partial as _partial
+from os import cpu_count as _cpu_count
+from threading import Lock as _Lock
+from threading import local as _local
 import xarray as _xr
 import numpy as _np
 import nchandy as _nch
 
+try:
+    from netCDF4 import Dataset as _Dataset  # pylint: disable=E0611
+except ImportError:
+    _Dataset = None
+
 _log = _logging.getLogger('nchandy')
 _fmt_str = '%(asctime)s.%(msecs)03d - %(name)s - %(levelname)s - %(message)s'
 _formatter = _logging.Formatter(_fmt_str, datefmt='%Y-%m-%dT%H:%M:%S')
 
 
-_exclude_vars_ = ('TFLAG',)
-_emis_vars_ = ['TFLAG', 'AACD', 'ACET', 'ALD2', 'ALDX', 'APIN', 'BENZ',
-               'CH4', 'CO', 'ETH', 'ETHA', 'ETHY', 'ETOH', 'FACD', 'FORM',
-               'IOLE', 'ISOP', 'IVOC', 'KET', 'MEOH', 'NAPH', 'NH3', 'NO',
-               'NO2', 'NVOL', 'OLE', 'PAL', 'PAR', 'PCA', 'PCL', 'PEC',
-               'PFE', 'PH2O', 'PK', 'PMC', 'PMG', 'PMN', 'PMOTHR', 'PNA',
-               'PNCOM', 'PNH4', 'PNO3', 'POC', 'PRPA', 'PSI', 'PSO4',
-               'PTI', 'SO2', 'SULF', 'TERP', 'TOL', 'UNR', 'XYLMN']
+_has_dask_ = _find_spec('dask') is not None
+_ncks_ = _which('ncks')  # path of NCO ncks executable or None
+# xarray>=2023.09 aligns 'auto' dask chunks to on-disk chunks
+_auto_chunks_ = tuple(int(i) for i in _xr.__version__.split('.')[:2]
+                      if i.isdigit()) >= (2023, 9)
+_exclude_vars_ = frozenset(('TFLAG',))
+_emis_vars_tuple_ = ('TFLAG', 'AACD', 'ACET', 'ALD2', 'ALDX', 'APIN', 'BENZ',
+                     'CH4', 'CO', 'ETH', 'ETHA', 'ETHY', 'ETOH', 'FACD',
+                     'FORM', 'IOLE', 'ISOP', 'IVOC', 'KET', 'MEOH', 'NAPH',
+                     'NH3', 'NO', 'NO2', 'NVOL', 'OLE', 'PAL', 'PAR', 'PCA',
+                     'PCL', 'PEC', 'PFE', 'PH2O', 'PK', 'PMC', 'PMG', 'PMN',
+                     'PMOTHR', 'PNA', 'PNCOM', 'PNH4', 'PNO3', 'POC', 'PRPA',
+                     'PSI', 'PSO4', 'PTI', 'SO2', 'SULF', 'TERP', 'TOL', 'UNR',
+                     'XYLMN')
+_emis_vars_ = list(_emis_vars_tuple_)
+
+
+def _open_disk_chunked(path, **kwargs):
+    """
+    Open a NetCDF file lazily with dask chunks aligned to on-disk chunks.
+
+    Dask chunks are multiples of on-disk chunks of about dask's default
+    chunk size ('auto'); older xarray uses one dask chunk per disk chunk.
+    Falls back to a plain xarray.open_dataset if dask is not installed.
+    """
+    if _has_dask_:
+        return _xr.open_dataset(
+            path, chunks='auto' if _auto_chunks_ else {}, **kwargs)
+    return _xr.open_dataset(path, **kwargs)
+
+
+def _write(ds, path, algo='zstd', engine=None):
+    """
+    Write xarray.Dataset to a NETCDF4 (HDF5) file.
 
+    netcdf4 engine is used if engine is None. h5netcdf cannot write the
+    netCDF-C filter plugins (zstd, lz4), so zlib (gzip) is used instead
+    with a warning.
+    """
+    if engine is None:
+        engine = 'netcdf4'
+    if engine == 'h5netcdf':
+        if algo != 'zlib':
+            _log.warning(f'{algo} is not supported by h5netcdf. Using zlib.')
+        filters = _nch._algo_names_.values()  # pylint: disable=W0212
+        for v in ds.variables.values():
+            if v.encoding.get('compression') in filters:
+                v.encoding['compression'] = 'gzip'
+    ds.to_netcdf(path, format='NETCDF4', engine=engine)
+
+
+@_contextmanager
+def _outfile(from_file, to_file=None):
+    """
+    Context manager yielding from_file and file to write as Path objects.
 
-def scale_ncdf(from_file, factor, variables=None,
-               exclude_variables=('TFLAG',), to_file=None) -> None:
+    If to_file is from_file (or None), a temporary file next to it is
+    yielded and atomically moved over from_file on success. The temporary
+    file is removed on error.
+    """
+    from_file = _Path(from_file)
+    to_file = from_file if to_file is None else _Path(to_file)
+    modify = from_file == to_file
+    tmp = to_file.with_name(to_file.name + '.tmp') if modify else to_file
+    try:
+        yield from_file, tmp
+    except BaseException:
+        if modify:
+            try:
+                tmp.unlink()
+            except FileNotFoundError:
+                pass
+        raise
+    if modify:
+        _replace(tmp, from_file)
+        _log.debug(f'tmp file renamed to {from_file}')
+
+
+def _scale_group(src, dst, factor,  # pylint: disable=R0913
+                 variables, exclude_variables, dlevel, algo):
+    """
+    Copy a netCDF4 group and its subgroups from src to dst, scaling them.
+
+    Return the set of variable names found in src and its subgroups.
+    """
+    dst.setncatts(src.__dict__)
+    for k, d in src.dimensions.items():
+        dst.createDimension(k, None if d.isunlimited() else len(d))
+    scaled = src.variables.keys() if variables is None else variables
+    scaled = frozenset(scaled) - exclude_variables
+    for k, v in src.variables.items():
+        attrs = {a: v.getncattr(a) for a in v.ncattrs()}
+        fill = attrs.pop('_FillValue', None)
+        enc = {}
+        if dlevel is not None and v.ndim and \
+                isinstance(v.dtype, _np.dtype):
+            enc = _nch._compression_encoding(  # pylint: disable=W0212
+                dlevel, algo, v)
+        v2 = dst.createVariable(k, v.dtype, v.dimensions,
+                                fill_value=fill, **enc)
+        v2.setncatts(attrs)
+        if k not in scaled:
+            v.set_auto_maskandscale(False)
+            v2.set_auto_maskandscale(False)
+        for sl in _nch._slabs(v):  # pylint: disable=W0212
+            buf = _np.asanyarray(v[sl])
+            if k in scaled:
+                f = buf.dtype.type(factor) if buf.dtype.kind == 'f' \
+                    else factor
+                _np.multiply(buf, f, out=buf)
+            v2[sl] = buf
+        if k in scaled:
+            _log.debug(f'{k} variable scaled by {factor}')
+    found = set(src.variables)
+    for k, g in src.groups.items():
+        found |= _scale_group(g, dst.createGroup(k), factor, variables,
+                              exclude_variables, dlevel, algo)
+    return found
+
+
+def scale_ncdf(from_file, factor, variables=None,  # pylint: disable=R0913
+               exclude_variables=_exclude_vars_, to_file=None, dlevel=5,
+               algo='zstd') -> None:
     """
     Scale Emission File by netCDF4 library.
 
+    Variables are streamed slab by slab into a new NETCDF4 file, which is
+    chunked by nchandy._pick_chunks and compressed. Groups are copied
+    recursively and variables are scaled by name in every group.
+
     Args:
         from_file (FILENAME)     : NetCDF file to scale.
         factor (FLOAT)           : Scale factor.
         variables (str|list)     : Name of variables to scale.
         exclude_vars (str| list) : Name of variables to exclude from scaling.
         to_file (FILENAME)       : New file name for scaled NetCDF data.
+        dlevel (INT)             : Compression/deflate level between [0-9].
+        algo (str)               : Compression algorithm; 'zstd', 'lz4' or
+                                   'zlib'. Default is 'zstd'.
     Return:
         None
     """
-    try:
-        from netCDF4 import Dataset as _Dataset  # pylint: disable=E0611,C0415
-    except ImportError:
+    if _Dataset is None:
         print('Install netCDF4 library to use this functionality')
         return
-
-    if isinstance(from_file, str):
-        from_file = _Path(from_file)
-
-    if exclude_variables is None:
-        exclude_variables = []
-
-    if to_file is None:
-        to_file = from_file
-
-    modify = from_file == to_file
-    if modify:
-        to_file = _Path(str(to_file) + '.tmp')
-    _copy2(from_file, to_file)
-
-    nco = _Dataset(to_file, 'r+')
-    nco = _nch.scale_ncdf(nco, factor, variables, exclude_variables)
-    nco.close()
-
-    if modify:
-        _remove(from_file)
-        _mv(to_file, from_file)
-        _log.debug(f'tmp file renamed to {from_file}')
+    _nch._check_dlevel(dlevel)  # pylint: disable=W0212
+    _nch._check_algo(algo)  # pylint: disable=W0212
+
+    if isinstance(variables, str):
+        variables = [variables]
+    exclude_variables = _nch._as_set(  # pylint: disable=W0212
+        exclude_variables)
+
+    with _outfile(from_file, to_file) as (from_file, to_file):
+        with _Dataset(from_file, 'r') as src, \
+                _Dataset(to_file, 'w', format='NETCDF4') as dst:
+            found = _scale_group(src, dst, factor, variables,
+                                 exclude_variables, dlevel, algo)
+    for k in variables or ():
+        if k not in found:
+            _log.debug(f'Var:{k} was not found in dataset. Skipping!')
     _log.info(f'Scaled [netCDF4]: {from_file}')
 
 
 def scale_xr(from_file, factor, variables=None,  # pylint: disable=R0913
-             exclude_variables=('TFLAG',), dlevel=5,
-             to_file=None) -> None:
+             exclude_variables=_exclude_vars_, dlevel=5,
+             to_file=None, algo='zstd', significant_digits=None,
+             storage_dtype=None, engine=None) -> None:
     """
     Scale Emission File by xarray library.
 
@@ -89,35 +216,30 @@ def scale_xr(from_file, factor, variables=None,  # pylint: disable=R0913
         dlevel (INT)             : Compression/deflate level between [0-9].
                                    Default is 5.
         to_file (FILENAME)       : New file name for scaled NetCDF data.
+        algo (str)               : Compression algorithm; 'zstd', 'lz4' or
+                                   'zlib'. Default is 'zstd'.
+        significant_digits (INT) : Quantize scaled data to significant
+                                   digits. Default is None.
+        storage_dtype (str)      : Data type of scaled variables in file,
+                                   e.g. 'float32'. Default is the dtype of
+                                   scaled data.
+        engine (str)             : xarray engine to write file; 'netcdf4'
+                                   or 'h5netcdf'. Default is 'netcdf4'.
     Return:
         None
     """
-    if isinstance(from_file, str):
-        from_file = _Path(from_file)
-
-    if exclude_variables is None:
-        exclude_variables = []
-
-    if to_file is None:
-        to_file = from_file
-
-    modify = from_file == to_file
-    if modify:
-        to_file = _Path(str(to_file) + '.tmp')
-
-    ds = _nch.scale_xr(_xr.open_dataset(from_file), factor, variables,
-                       exclude_variables, dlevel)
-    ds.to_netcdf(to_file)
-
-    if modify:
-        _remove(from_file)
-        _mv(to_file, from_file)
-        _log.debug(f'tmp file renamed to {from_file}')
+    with _outfile(from_file, to_file) as (from_file, to_file):
+        ds = _nch.scale_xr(_open_disk_chunked(from_file), factor, variables,
+                           exclude_variables, dlevel, algo, significant_digits,
+                           storage_dtype)
+        _write(ds, to_file, algo, engine)
     _log.info(f'Scaled: {from_file}')
 
 
-def scale_emis(from_file, factor,
-               dlevel=5, to_file=None) -> None:
+def scale_emis(from_file, factor,  # pylint: disable=R0913
+               dlevel=5, to_file=None, algo='zstd',
+               significant_digits=None, storage_dtype=None,
+               engine=None) -> None:
     """
     Scale Emission File by xarray library.
 
@@ -127,40 +249,43 @@ def scale_emis(from_file, factor,
         dlevel (INT)             : Compression/deflate level between [0-9].
                                    Default is 5.
         to_file (FILENAME)       : New file name for scaled NetCDF data.
+        algo (str)               : Compression algorithm; 'zstd', 'lz4' or
+                                   'zlib'. Default is 'zstd'.
+        significant_digits (INT) : Quantize scaled data to significant
+                                   digits. Default is None.
+        storage_dtype (str)      : Data type of scaled variables in file.
+                                   Default is the dtype of scaled data.
+        engine (str)             : xarray engine to write file; 'netcdf4'
+                                   or 'h5netcdf'. Default is 'netcdf4'.
     Return:
         None
     """
-    scale_xr(from_file, factor, _emis_vars_, _exclude_vars_, dlevel, to_file)
+    scale_xr(from_file, factor, _emis_vars_, _exclude_vars_, dlevel, to_file,
+             algo, significant_digits, storage_dtype, engine)
 
 
-def compress(from_file, quantize=None, dlevel=5, to_file=None) -> None:
+def compress(from_file, quantize=None,  # pylint: disable=R0913
+             dlevel=5, to_file=None, algo='zstd', engine=None) -> None:
     """
     Compress a single NetCDF File.
 
     Args:
         from_file (FILENAME) : File to compress.
-        quantize (INT)       : Decimal precision to truncate data.
+        quantize (INT)       : Number of significant decimal digits to keep.
         dlevel (INT)         : Compression/deflate level between [0-9].
         to_file (FILENAME)   : New name of compressed NetCDF file.
+        algo (str)           : Compression algorithm; 'zstd', 'lz4' or
+                               'zlib'. Default is 'zstd'.
+        engine (str)         : xarray engine to write file; 'netcdf4' or
+                               'h5netcdf'. Default is 'netcdf4'.
     Return:
         None
     """
-    if to_file is None:
-        to_file = from_file
-
-    modify = from_file == to_file
-    if modify:
-        to_file = _Path(str(to_file) + '.tmp')
-
-    ds = _xr.open_dataset(from_file)
-    ds = _nch.compress(ds, quantize, dlevel)
-    ds.to_netcdf(to_file)
-    ds.close()
-
-    if modify:
-        _remove(from_file)
-        _mv(to_file, from_file)
-        _log.debug(f'tmp file renamed to {from_file}')
+    with _outfile(from_file, to_file) as (from_file, to_file):
+        ds = _open_disk_chunked(from_file)
+        ds = _nch.compress(ds, quantize, dlevel, algo)
+        _write(ds, to_file, algo, engine)
+        ds.close()
     _log.info(f'Compressed: {from_file}')
 
 
@@ -173,6 +298,115 @@ def _set_or_create_attr(var, attr_name, attr_value):
     return
 
 
+def _var_stats(x_var, y_var,  # pylint: disable=R0913
+               lock=None, scratch=None, slabs=None):
+    """
+    Compare two netCDF4 variables slab by slab.
+
+    netCDF-C is not thread-safe, so when called from several threads pass
+    a shared lock and the slabs, which are found by querying the file;
+    only the reads are serialized, the arithmetic is not.
+
+    Args:
+        x_var (netCDF4.Variable) : Original variable.
+        y_var (netCDF4.Variable) : Compressed variable.
+        lock (threading.Lock)    : Lock guarding netCDF reads.
+        scratch (dict)           : Difference buffers by shape and dtype,
+                                   reused across calls of a single thread.
+        slabs (list)             : Slabs of y_var (See nchandy._slabs).
+    Return:
+        tuple of x range (only logged, None unless DEBUG), y range,
+        max. abs. error, sum of squared errors and number of compared
+        elements.
+    """
+    debug = _log.isEnabledFor(_logging.DEBUG)
+    x_range = [_np.inf, -_np.inf] if debug else None
+    y_range = [_np.inf, -_np.inf]
+    maxe, sse, n = 0, 0.0, 0
+    lock = _nullcontext() if lock is None else lock
+    if slabs is None:
+        slabs = _nch._slabs(y_var)  # pylint: disable=W0212
+    for sl in slabs:
+        with lock:
+            xs, ys = x_var[sl], y_var[sl]
+        if _np.size(ys) == 0:
+            continue
+        if debug:
+            x_range = [min(x_range[0], xs.min()),
+                       max(x_range[1], xs.max())]
+        y_range = [min(y_range[0], ys.min()), max(y_range[1], ys.max())]
+        xd, yd = _np.ma.getdata(xs), _np.ma.getdata(ys)
+        # float32 stays float32; only the sum of squares is float64
+        dt = _np.result_type(xd, yd)
+        dt = dt if dt.kind == 'f' else _np.dtype('float64')
+        d = None if scratch is None else scratch.get((xd.shape, dt))
+        if d is None:
+            d = _np.empty(xd.shape, dt)
+            if scratch is not None:
+                scratch[(xd.shape, dt)] = d
+        _np.subtract(xd, yd, out=d)
+        mask = _np.ma.getmaskarray(xs) | _np.ma.getmaskarray(ys)
+        if mask.any():
+            d = d[~mask]
+        if d.size == 0:
+            continue
+        _np.abs(d, out=d)
+        maxe = _np.maximum(maxe, d.max())
+        d = d.reshape(-1)
+        sse += float(_np.einsum('i,i->', d, d, dtype=_np.float64))
+        n += d.size
+    return x_range, y_range, maxe, sse, n
+
+
+def _append_stats(from_file, to_file, quantize):
+    """Write quantization error statistics of to_file into its attributes."""
+    pm_str = 'precision_MAXE'
+    str_rmse = 'precision_RMSE'
+    str_range = 'range'
+    # nco1, nco2 = _Dataset(from_file, 'r'), _Dataset(to_file, 'r+')
+    with _Dataset(from_file, 'r') as nco1, _Dataset(to_file, 'r+') as nco2:
+        glob = {'maxe': 0, 'sse': 0.0, 'n': 0}
+        lock = _Lock()
+
+        nco1_vars = nco1.variables
+        # only float data is quantized; TFLAG, int and char are skipped
+        items = [(k, v) for k, v in nco2.variables.items()
+                 if k not in _exclude_vars_ and v.size and
+                 isinstance(v.dtype, _np.dtype) and v.dtype.kind == 'f']
+        # file metadata is queried here; threads only read slabs under lock
+        tasks = [(nco1_vars[k], v,
+                  list(_nch._slabs(v)))  # pylint: disable=W0212
+                 for k, v in items]
+
+        local = _local()
+
+        def stats(task):
+            if not hasattr(local, 'scratch'):
+                local.scratch = {}
+            x_var, y_var, slabs = task
+            return _var_stats(x_var, y_var, lock, local.scratch, slabs)
+
+        workers = _nch._threads_ or _cpu_count() or 1  # pylint: disable=W0212
+        with _ThreadPool(max(1, min(len(tasks), workers))) as ex:
+            results = list(ex.map(stats, tasks))
+        for (k, v), (x_range, y_range, maxe, sse, n) in zip(items, results):
+            _log.debug(f'x_range: {x_range}, y_range: {y_range}')
+            rmse = _np.sqrt(sse / n) if n else 0.0
+            _log.debug(f'Processed {v.name}: MAE: {maxe} RMSE: {rmse}')
+            var_attrs = {str_range: y_range, pm_str: maxe, str_rmse: rmse}
+            glob['maxe'] = max(glob['maxe'], maxe)
+            glob['sse'] += sse
+            glob['n'] += n
+            for k1, v1 in var_attrs.items():
+                _set_or_create_attr(v, k1, v1)
+        gmaxe = glob['maxe']
+        grmse = _np.sqrt(glob['sse'] / glob['n']) if glob['n'] else 0.0
+        _log.info(f'{pm_str}: {gmaxe}, {str_rmse}: {grmse}')
+        nco2.precision = quantize
+        nco2.precision_MAXE = gmaxe
+        nco2.precision_RMSE = grmse
+
+
 def ncks(from_file, quantize=None, dlevel=5, to_file=None,
          append_stats=True) -> None:
     """
@@ -188,64 +422,57 @@ def ncks(from_file, quantize=None, dlevel=5, to_file=None,
     """
     if quantize is None and dlevel is None:
         raise ValueError('One of quantize or dlevel must be set.')
+    if _ncks_ is None:
+        raise FileNotFoundError('ncks (NCO) executable was not found')
+    if append_stats and _Dataset is None:
+        raise ImportError('Install netCDF4 library to append statistics')
 
     if quantize is not None:
         q = float(quantize) if quantize.startswith('.') else int(quantize)
         if isinstance(q, int) and q == 0:
             raise ValueError('NSD quantize cannot be 0.')
 
-    if to_file is None:
-        to_file = from_file
+    with _outfile(from_file, to_file) as (from_file, to_file):
+        dfl_lvl = ["-L", str(dlevel), "--baa=8"] if dlevel is not None else []
+        ppc = ["--ppc", f"default={quantize}"] if quantize is not None else []
+        cmd = [_ncks_, "-O", "-7", "--no_abc"] + dfl_lvl + ppc + \
+              [_fspath(from_file), _fspath(to_file)]
+        stdout = None if _log.isEnabledFor(_logging.DEBUG) else _DEVNULL
+        try:
+            _run(cmd, check=True, stdout=stdout, stderr=_PIPE)
+        except _CalledProcessError as e:
+            _log.error(e.stderr.decode(errors='replace').strip())
+            raise
+
+        if append_stats:
+            _append_stats(from_file, to_file, quantize)
+    _log.info(f'Compressed: {from_file}')
 
-    modify = from_file == to_file
-    if modify:
-        to_file = _Path(str(to_file) + '.tmp')
-
-    dfl_lvl = ["-L", str(dlevel), "--baa=8"] if dlevel is not None else []
-    ppc = ["--ppc", f"default={quantize}"] if quantize is not None else []
-    cmd = ["ncks", "-O", "-7", "--no_abc"] + dfl_lvl + ppc + \
-          [str(from_file), str(to_file)]
-    _subp.run(cmd, check=True, capture_output=True)
-
-    if append_stats:
-        pm_str = 'precision_MAXE'
-        str_rmse = 'precision_RMSE'
-        str_range = 'range'
-        from netCDF4 import Dataset as _Dataset  # pylint: disable=E0611,C0415
-        # nco1, nco2 = _Dataset(from_file, 'r'), _Dataset(to_file, 'r+')
-        with _Dataset(from_file, 'r') as nco1, _Dataset(to_file, 'r+') as nco2:
-            glob = {'maxe': 0, 'rmse': 0}
-            for k, v in nco2.variables.items():
-                x = nco1.variables[k][:]
-                y = v[:]
-                x_range = [x.min(), x.max()]
-                y_range = [y.min(), y.max()]
-                dif = x - v
-                _log.debug(f'x_range: {x_range}, y_range: {y_range}')
-                maxe = _np.max(abs(dif))
-                rmse = _np.sqrt((dif**2).mean())
-                _log.debug(f'Processed {v.name}: MAE: {maxe} RMSE: {rmse}')
-                var_attrs = {str_range: y_range, pm_str: maxe, str_rmse: rmse}
-                glob['maxe'] = max(glob['maxe'], maxe)
-                glob['rmse'] = max(glob['rmse'], rmse)
-                for k1, v1 in var_attrs.items():
-                    _set_or_create_attr(v, k1, v1)
-                del x, y
-            gmaxe, grmse = glob['maxe'], glob['rmse']
-            _log.info(f'{pm_str}: {gmaxe}, {str_rmse}: {grmse}')
-            nco2.precision = quantize
-            nco2.precision_MAXE = gmaxe
-            nco2.precision_RMSE = grmse
 
-    if modify:
-        _remove(from_file)
-        _mv(to_file, from_file)
-        _log.debug(f'tmp file renamed to {from_file}')
-    _log.info(f'Compressed: {from_file}')
+def ncks_batch(files, max_workers=4, **kwargs) -> None:
+    """
+    Compress NetCDF Files in place by ncks in parallel processes.
+
+    Each file is handled by ncks in its own process. The work is mostly
+    disk-bound, so more workers than the storage can serve (about 4 on a
+    single disk or parallel file system stripe) reduce throughput.
+
+    Args:
+        files (list)      : Files to compress.
+        max_workers (INT) : Maximum number of parallel processes.
+        **kwargs          : Other arguments passed to ncks except to_file.
+    Return:
+        None
+    """
+    if 'to_file' in kwargs:
+        raise ValueError('to_file cannot be set for multiple files.')
+    with _ProcessPool(max_workers) as ex:
+        list(ex.map(_partial(ncks, **kwargs), files))
 
 
 def regrid(from_file, lats, lons, dim_names=None,  # pylint: disable=R0913
-           dlevel=5, method='bilinear', to_file=None) -> None:
+           dlevel=5, method='bilinear', to_file=None,
+           algo='zstd', engine=None) -> None:
     """
     Regrid NetCDF file.
 
@@ -256,19 +483,14 @@ def regrid(from_file, lats, lons, dim_names=None,  # pylint: disable=R0913
         dim_names (list|tuple) : name of lat/lon dimensions.
         method (str)           : regridding method. (See xesmf.Regridder)
         to_file (FILENAME)     : New path for regridded NetCDF file.
+        algo (str)             : Compression algorithm; 'zstd', 'lz4' or
+                                 'zlib'. Default is 'zstd'.
+        engine (str)           : xarray engine to write file; 'netcdf4' or
+                                 'h5netcdf'. Default is 'netcdf4'.
 
     """
-    if to_file is None:
-        to_file = from_file
-
-    modify = from_file == to_file
-    if modify:
-        to_file = _Path(str(to_file) + '.tmp')
-    ds = _xr.open_dataset(from_file, cache=False)
-    ds2 = _nch.regrid(ds, lats, lons, dim_names, dlevel, method)
-    ds2.to_netcdf(to_file)
-    if modify:
-        _remove(from_file)
-        _mv(to_file, from_file)
-        _log.debug(f'tmp file renamed to {from_file}')
+    with _outfile(from_file, to_file) as (from_file, to_file):
+        ds = _open_disk_chunked(from_file, cache=False)
+        ds2 = _nch.regrid(ds, lats, lons, dim_names, dlevel, method, algo)
+        _write(ds2, to_file, algo, engine)
     _log.info(f'Regridded: {from_file}')